@@ -0,0 +1,232 @@
+"""
+artifactpublisher.py
+~~~~~~
+Upload run artifacts to the MLflow artifact store (MinIO / S3) in background threads
+"""
+
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+MB = 1024 ** 2
+
+
+class ArtifactPublisher:
+    """
+    Publish local files as artifacts of an MLflow run without blocking the pipeline
+    """
+
+    def __init__(self, artifact_uri, max_workers=4, max_pending=8,
+                 multipart_chunksize=8 * MB, max_concurrency=8, s3_client=None):
+        """
+        Parameters
+        ----------
+        artifact_uri: String
+            Artifact root of the run, e.g. mlflow.get_artifact_uri()
+        max_workers: int
+            Number of files uploaded in parallel
+        max_pending: int
+            Number of queued plus running uploads before publish() blocks
+        multipart_chunksize: int
+            Part size in bytes for multipart uploads
+        max_concurrency: int
+            Number of threads uploading parts of a single file
+        s3_client: boto3 client, optional
+            Client to use - defaults to one pointing at MLFLOW_S3_ENDPOINT_URL,
+            which also allows to run against a local S3 stand-in
+        """
+
+        parsed = urlparse(artifact_uri)
+        self.scheme = parsed.scheme or "file"
+
+        if self.scheme == "s3":
+            # boto3 is only needed for S3 stores
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+
+            self.bucket = parsed.netloc
+            self.root = parsed.path.lstrip("/")
+            self.s3_client = s3_client or boto3.client(
+                "s3", endpoint_url=os.environ.get("MLFLOW_S3_ENDPOINT_URL"))
+            self.transfer_config = TransferConfig(multipart_threshold=multipart_chunksize,
+                                                  multipart_chunksize=multipart_chunksize,
+                                                  max_concurrency=max_concurrency)
+        elif self.scheme == "file":
+            self.root = parsed.path
+        else:
+            raise ValueError(f"Unsupported artifact store scheme: {self.scheme}")
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="artifact-publisher")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._published = []
+
+        print("ArtifactPublisher object created")
+
+    def _destination(self, local_path, artifact_path):
+        """
+        Build the destination key / path of an artifact inside the run
+        """
+
+        parts = [self.root, artifact_path, os.path.basename(local_path)]
+
+        if self.scheme == "s3":
+            return "/".join(p.strip("/") for p in parts if p)
+
+        return os.path.join(*[p for p in parts if p])
+
+    def _upload(self, local_path, destination):
+        """
+        Upload one file and release its queue slot
+        """
+
+        try:
+            if self.scheme == "s3":
+                self.s3_client.upload_file(local_path, self.bucket, destination,
+                                           Config=self.transfer_config)
+            else:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.copyfile(local_path, destination)
+
+            print(f"Artifact {local_path} uploaded")
+            return destination
+        finally:
+            self._slots.release()
+
+    def publish(self, local_path, artifact_path=None):
+        """
+        Queue a file for upload - blocks only while max_pending uploads are in flight
+
+        Parameters
+        ----------
+        local_path: String
+            File written once to local disk
+        artifact_path: String, optional
+            Directory inside the run's artifact root
+
+        Returns
+        -------
+        future: concurrent.futures.Future
+            Resolves to the destination key / path once uploaded
+        """
+
+        destination = self._destination(local_path, artifact_path)
+        size = os.path.getsize(local_path)
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._upload, local_path, destination)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        self._published.append((future, destination, size))
+
+        return future
+
+    def _run(self, fn, args, kwargs):
+        """
+        Run one task and release its queue slot
+        """
+
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue an upload done by another client, e.g. mlflow.pyfunc.log_model, which
+        has to package the artifacts itself - flush waits for it but cannot verify sizes
+
+        Returns
+        -------
+        future: concurrent.futures.Future
+            Resolves to the return value of fn
+        """
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._run, fn, args, kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        self._published.append((future, getattr(fn, "__name__", repr(fn)), None))
+
+        return future
+
+    def _verify(self, destination, size):
+        """
+        Check an uploaded artifact exists with the expected size
+        """
+
+        if size is None:
+            return
+
+        if self.scheme == "s3":
+            remote_size = self.s3_client.head_object(Bucket=self.bucket,
+                                                     Key=destination)["ContentLength"]
+        else:
+            remote_size = os.path.getsize(destination)
+
+        if remote_size != size:
+            raise RuntimeError(f"Artifact {destination} has {remote_size} bytes, expected {size}")
+
+    def flush(self):
+        """
+        Wait for all queued uploads and verify them in the artifact store
+
+        Returns
+        -------
+        destinations: list
+            Keys / paths of all published artifacts
+
+        Raises
+        ------
+        RuntimeError
+            Listing every artifact which failed to upload or verify
+        """
+
+        published, self._published = self._published, []
+
+        destinations = []
+        failures = []
+
+        # Check every artifact, so one failed upload does not hide the others
+        for future, destination, size in published:
+            try:
+                future.result()
+                self._verify(destination, size)
+                destinations.append(destination)
+            except Exception as e:
+                failures.append(f"{destination}: {e!r}")
+
+        print(f"{len(destinations)} artifacts published and verified")
+
+        if failures:
+            raise RuntimeError(f"{len(failures)} artifacts failed to publish:\n" + "\n".join(failures))
+
+        return destinations
+
+    def close(self):
+        """
+        Flush pending uploads and shut down the worker threads
+        """
+
+        try:
+            return self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True)
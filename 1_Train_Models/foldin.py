@@ -0,0 +1,269 @@
+"""
+foldin.py
+~~~~~~
+Fold new users & events into a trained implicit model between nightly training runs
+Major steps:
+    #1 Map new journey events to ratings with PreProcess logic
+    #2 Recompute factors of affected users against fixed item factors
+    #3 Recompute factors of affected items against the updated user factors
+    #4 Refresh related products of affected items & publish them as delta
+"""
+
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from preprocessing import PreProcess
+
+
+DELTA_PATH = "./0_Data/related_items_delta.json"
+
+
+class IncrementalUpdate:
+    """
+    Update user & item factors of an implicit ALS model from micro-batches of journey events
+    """
+
+    def __init__(self, sparse_item_user, df_products, df_clients, model_implicit, alpha, N = 11):
+        self.sparse_item_user = sparse_item_user.tocsr()
+        self.df_products = df_products
+        self.df_clients = df_clients
+        self.model_implicit = model_implicit
+        self.alpha = alpha
+        self.N = N
+
+        print("IncrementalUpdate object created")
+
+    def _map_events(self, events):
+        """
+        Map raw journey events to ratings and integer ids - unknown clients get new ids
+
+        Parameters
+        ----------
+        events: Dataframe
+            New raw user journey events, same format as journey.csv
+
+        Returns
+        -------
+        actions: Dataframe
+            product_int_id, client_int_id & rating for each client/product pair in the batch
+        """
+
+        actions = PreProcess(self.df_products, events).create_ratings()
+
+        # Append unseen clients with consecutive integer ids
+        new_clients = actions.loc[~actions['clientId'].isin(self.df_clients['clientId']), ['clientId']].drop_duplicates()
+        new_clients = new_clients.assign(
+            client_int_id=np.arange(len(self.df_clients), len(self.df_clients) + len(new_clients)))
+        self.df_clients = pd.concat([self.df_clients, new_clients], ignore_index=True)
+
+        actions = actions.merge(self.df_products[['sku', 'product_int_id']], on='sku')
+        actions = actions.merge(self.df_clients, on='clientId', how='left')
+
+        print(f"{len(actions)} interactions, {len(new_clients)} new clients in batch")
+
+        return actions[['product_int_id', 'client_int_id', 'rating']]
+
+    def _resize(self, n_items, n_users):
+        """
+        Grow interaction matrix & factors to cover new products and clients
+        """
+
+        n_items = max(n_items, self.sparse_item_user.shape[0])
+        n_users = max(n_users, self.sparse_item_user.shape[1])
+
+        if (n_items, n_users) != self.sparse_item_user.shape:
+            self.sparse_item_user.resize((n_items, n_users))
+
+        def grow(factors, n):
+            if len(factors) >= n:
+                return factors
+            return np.vstack([factors, np.zeros((n - len(factors), factors.shape[1]), dtype=factors.dtype)])
+
+        self.model_implicit.item_factors = grow(self.model_implicit.item_factors, n_items)
+        self.model_implicit.user_factors = grow(self.model_implicit.user_factors, n_users)
+
+    def _solve(self, fixed, confidence):
+        """
+        Solve the ALS least squares problem for each row of confidence against fixed factors
+
+        Parameters
+        ----------
+        fixed: numpy array [n, factors]
+            Factors which are kept fixed
+        confidence: sparse csr_matrix [rows, n]
+            Confidence weights of the rows to solve for
+
+        Returns
+        -------
+        factors: numpy array [rows, factors]
+        """
+
+        k = fixed.shape[1]
+        YtY = fixed.T.dot(fixed) + self.model_implicit.regularization * np.eye(k)
+
+        factors = np.zeros((confidence.shape[0], k), dtype=fixed.dtype)
+
+        for row in range(confidence.shape[0]):
+            start, end = confidence.indptr[row], confidence.indptr[row + 1]
+            if start == end:
+                continue
+
+            Yi = fixed[confidence.indices[start:end]]
+            conf = confidence.data[start:end]
+
+            A = YtY + Yi.T.dot((conf - 1)[:, None] * Yi)
+            b = Yi.T.dot(conf)
+
+            factors[row] = np.linalg.solve(A, b)
+
+        return factors
+
+    def _related_items(self, items):
+        """
+        Related products of the given items by cosine similarity of item factors
+
+        Returns
+        -------
+        delta: dictionary
+            Related products for each sku, same format as related_items.json
+        """
+
+        item_factors = self.model_implicit.item_factors
+        norms = np.linalg.norm(item_factors, axis=1)
+        norms[norms == 0] = 1
+        normed = item_factors / norms[:, None]
+
+        products = self.df_products.set_index('product_int_id')
+        
+        # Products without interactions (e.g. pruned) keep random factors - never recommend them
+        candidates = np.diff(self.sparse_item_user.indptr) > 0
+        n_related = min(self.N - 1, len(normed) - 1)
+
+        delta = {}
+        for item in items:
+            if item not in products.index:
+                continue
+
+            scores = normed.dot(normed[item])
+            scores[item] = -np.inf
+            scores[~candidates[:len(scores)]] = -np.inf
+
+            best = np.argpartition(-scores, n_related)[:n_related]
+            best = best[np.argsort(-scores[best])]
+            best = best[np.isfinite(scores[best])]
+
+            delta[products.loc[item, 'sku']] = {
+                str(rank): products.loc[related, ['sku', 'name']].to_dict()
+                for rank, related in enumerate(best, start=1)
+            }
+
+        return delta
+
+    def update(self, events):
+        """
+        Fold a micro-batch of journey events into the model
+
+        Parameters
+        ----------
+        events: Dataframe
+            New raw user journey events
+
+        Returns
+        -------
+        delta: dictionary
+            Refreshed related products of all items touched by the batch
+        """
+
+        actions = self._map_events(events)
+        if actions.empty:
+            return {}
+
+        items = actions['product_int_id'].to_numpy()
+        users = actions['client_int_id'].to_numpy()
+
+        self._resize(items.max() + 1, users.max() + 1)
+
+        # Without the raw history a pair keeps its strongest rating
+        batch = sparse.csr_matrix((actions['rating'].to_numpy(np.float32), (items, users)),
+                                  shape=self.sparse_item_user.shape, dtype=np.float32)
+        self.sparse_item_user = self.sparse_item_user.maximum(batch).tocsr()
+
+        users = np.unique(users)
+        items = np.unique(items)
+
+        # Users against fixed item factors
+        user_confidence = (self.sparse_item_user[:, users].T.tocsr() * self.alpha)
+        self.model_implicit.user_factors[users] = self._solve(self.model_implicit.item_factors, user_confidence)
+
+        # Items against updated user factors, so their neighbors can move
+        item_confidence = (self.sparse_item_user[items] * self.alpha).tocsr()
+        self.model_implicit.item_factors[items] = self._solve(self.model_implicit.user_factors, item_confidence)
+
+        # Drop norms cached by implicit for similar_items
+        if hasattr(self.model_implicit, '_item_norms'):
+            self.model_implicit._item_norms = None
+
+        print(f"Factors of {len(users)} users & {len(items)} items updated")
+
+        return self._related_items(items)
+
+
+def publish_delta(delta, path = DELTA_PATH):
+    """
+    Merge related products into the delta file picked up by the API
+
+    Parameters
+    ----------
+    delta: dictionary
+        Related products for each updated sku
+    path: String
+        Delta file, removed again by the nightly training run
+    """
+
+    merged = {}
+    if os.path.exists(path):
+        with open(path, 'r') as file:
+            merged = json.load(file)
+
+    merged.update(delta)
+
+    # Write to a temporary file first, so the API never reads a partial delta
+    with open(path + ".tmp", 'w') as outfile:
+        json.dump(merged, outfile)
+    os.replace(path + ".tmp", path)
+
+    print(f"{len(delta)} related products published to {path}")
+
+
+if __name__ == '__main__':
+
+    import joblib
+
+    # Usage: python3 foldin.py <new_journey_events.csv>
+    events = pd.read_csv(sys.argv[1])
+
+    # State of the last run - written by train.py & previous fold-ins
+    with open("0_Data/best_hyperparams.json", 'r') as file:
+        hyperparams = json.load(file)
+
+    # Only factor models can fold in new users - item-item models are refreshed by retraining
+    if hyperparams.get("model_type", "als") != "als":
+        sys.exit(f"Fold-in is not supported for model_type {hyperparams['model_type']}")
+
+    update = IncrementalUpdate(sparse.load_npz("0_Data/sparse_item_user.npz"),
+                               pd.read_csv("0_Data/df_products.csv", index_col=0),
+                               pd.read_csv("0_Data/df_clients.csv", index_col=0),
+                               joblib.load("implicit_model.joblib"),
+                               hyperparams["alpha"])
+
+    delta = update.update(events)
+    publish_delta(delta)
+
+    # Keep state for the next micro-batch
+    sparse.save_npz("0_Data/sparse_item_user.npz", update.sparse_item_user)
+    update.df_clients.to_csv("0_Data/df_clients.csv")
+    joblib.dump(update.model_implicit, "implicit_model.joblib", compress=True)
@@ -7,17 +7,36 @@ Train the implicit-model
 import numpy as np
 import implicit
 from implicit.evaluation import train_test_split as train_test_split_implicit
+from implicit.nearest_neighbours import CosineRecommender, BM25Recommender, TFIDFRecommender
 import itertools
+import scipy.sparse as sparse
 # from sklearn.model_selection import ParameterGrid
 # from scipy.sparse import coo_matrix, csr_matrix
 
+
+# Item-item models based on sparse co-occurrence, selectable instead of ALS
+NEAREST_NEIGHBOURS = {
+    "cosine": CosineRecommender,
+    "bm25": BM25Recommender,
+    "tfidf": TFIDFRecommender,
+}
+
+# Fixed split, so MAP@5 of runs with different pruning settings is comparable
+HOLDOUT_SEED = 42
+
 class TrainImplicit:
     """
     Train implicit model
     """
     
-    def __init__(self,sparse_item_user):
-        self.sparse_item_user = sparse_item_user
+    def __init__(self,sparse_item_user,sparse_item_user_unpruned=None):
+        # Single float32 interaction matrix shared by search & final fit
+        self.sparse_item_user = sparse_item_user.tocsr().astype(np.float32, copy=False)
+        # Unpruned interactions, from which the test set is taken
+        if sparse_item_user_unpruned is None:
+            self.sparse_item_user_unpruned = self.sparse_item_user
+        else:
+            self.sparse_item_user_unpruned = sparse_item_user_unpruned.tocsr().astype(np.float32, copy=False)
         print("ModelTrain object created")
 
     def _train_test_split(self,sparse):
@@ -45,6 +64,56 @@ class TrainImplicit:
         return train_item_user, test_item_user
     
                 
+    def _holdout_split(self):
+        """
+        Split the unpruned interactions with a fixed seed, so the test set is the same
+        for every pruning setting - training keeps only pairs which survived pruning
+        
+        The unpruned matrix is released afterwards, so only one search can be run per object
+        
+        Returns
+        -------
+        train_item_user:
+            Pruned Interaction Matrix for training
+        test_item_user:
+            Unpruned Interaction Matrix for testing
+        """
+        
+        if self.sparse_item_user_unpruned is None:
+            raise RuntimeError("Holdout was already split - create a new TrainImplicit object")
+        
+        state = np.random.get_state()
+        np.random.seed(HOLDOUT_SEED)
+        try:
+            train, test = self._train_test_split(self.sparse_item_user_unpruned)
+        finally:
+            np.random.set_state(state)
+        
+        if self.sparse_item_user_unpruned is not self.sparse_item_user:
+            pruned = sparse.csr_matrix((np.ones(self.sparse_item_user.nnz, dtype=np.float32),
+                                        self.sparse_item_user.indices, self.sparse_item_user.indptr),
+                                       shape=self.sparse_item_user.shape)
+            train = train.multiply(pruned).tocsr().astype(np.float32, copy=False)
+        
+        # Second full-size matrix is not needed anymore - train_best fits on the pruned one
+        self.sparse_item_user_unpruned = None
+        
+        return train, test
+    
+    
+    def _scale_confidence(self, sparse, ratings, alpha):
+        """
+        Overwrite the data of sparse in place with confidence weights ratings * alpha
+        
+        ratings is a copy of the raw ratings in sparse.data - only this float32 array is
+        kept besides the matrix, instead of a full scaled matrix per fit
+        """
+        
+        np.multiply(ratings, alpha, out=sparse.data, casting='unsafe')
+        
+        return sparse
+    
+    
     def random_search_implicit(self, num_samples = 5):
         """
         Sample random hyperparameters, fit an implicit-model, and evaluate it
@@ -69,10 +138,17 @@ class TrainImplicit:
         """
         
         # Train & Test Data #
-        train, test = self._train_test_split(self.sparse_item_user)
+        train, test = self._holdout_split()
+        
+        # implicit.evaluation expects user/item matrices - transpose once for all trials
+        train_user_items, test_user_items = train.T.tocsr(), test.T.tocsr()
+        del test
+        
+        # Raw ratings - train itself is scaled in place for every trial
+        ratings = train.data.copy()
         
         # internal fitting to finmodel
-        def fitting(train, test, num_samples):
+        def fitting(num_samples):
             
             i = 0
             
@@ -98,11 +174,11 @@ class TrainImplicit:
                 alpha = np.random.randint(1, 80)
                 
                 # create data
-                data_conf = (train * alpha).astype('double')
+                data_conf = self._scale_confidence(train, ratings, alpha)
                 
                 # Fit Model & Evaluate at MAP@K = 5
                 model_implicit.fit((data_conf),show_progress=True)
-                map5 = implicit.evaluation.mean_average_precision_at_k(model_implicit, train.tocsr(), test.tocsr(), K = 5)
+                map5 = implicit.evaluation.mean_average_precision_at_k(model_implicit, train_user_items, test_user_items, K = 5)
                 print(map5)
                 
                 print(f"  --- Implicit Model Fitting - Iteration {i} of {num_samples}")
@@ -115,16 +191,84 @@ class TrainImplicit:
         
             
         # Return max MAP5 & according hyperparams from random search
-        (map5, hyperparams_implicit) = max(fitting(train, test, \
-                                                   num_samples), key=lambda x: x[0])
+        (map5, hyperparams_implicit) = max(fitting(num_samples), key=lambda x: x[0])
         
         # Add Key-Value with name of model & map5 to dict
+        hyperparams_implicit['model_type'] = "als"
         hyperparams_implicit['map5'] = float(map5)    
         
         return hyperparams_implicit
     
     
     
+    def search_nearest_neighbours(self, num_samples = 5, model_type = "bm25"):
+        """
+        Sample random hyperparameters, fit an item-item model on co-occurrences,
+        and evaluate it on the test set with the same MAP@5 as the implicit-model.
+        
+        Similarities are computed in batches of rows and pruned to the K most
+        similar items per row, so memory stays bounded by n_items * K.
+    
+        Parameters
+        ----------
+    
+        num_samples: int, optional
+            Number of hyperparameter samples to evaluate.
+        model_type: String, optional
+            One of NEAREST_NEIGHBOURS: cosine, bm25, tfidf
+    
+    
+        Returns
+        -------
+    
+        hyperparams: dict
+            best hyperparameters incl. model_type & map5
+    
+        """
+        
+        # Train & Test Data #
+        train, test = self._holdout_split()
+        
+        # implicit.evaluation expects user/item matrices - transpose once for all trials
+        train_user_items, test_user_items = train.T.tocsr(), test.T.tocsr()
+        del test
+        
+        def sample_hyperparameters_nearest_neighbours():
+            """
+            Yield possible hyperparameter choices.
+            """
+            
+            while True:
+                hyperparams = {"K": np.random.randint(10, 200)}
+                if model_type == "bm25":
+                    hyperparams["K1"] = float(np.random.uniform(0.5, 2.0))
+                    hyperparams["B"] = float(np.random.uniform(0.25, 1.0))
+                yield hyperparams
+        
+        def fitting():
+            
+            for i, hyperparams in enumerate(itertools.islice(sample_hyperparameters_nearest_neighbours(), num_samples), 1):
+                
+                model_nn = NEAREST_NEIGHBOURS[model_type](**hyperparams)
+                
+                # Fit Model & Evaluate at MAP@K = 5
+                model_nn.fit(train, show_progress=True)
+                map5 = implicit.evaluation.mean_average_precision_at_k(model_nn, train_user_items, test_user_items, K = 5)
+                print(map5)
+                
+                print(f"  --- {model_type} Model Fitting - Iteration {i} of {num_samples}")
+                
+                yield (map5, hyperparams)
+        
+        # Return max MAP5 & according hyperparams from random search
+        (map5, hyperparams_nn) = max(fitting(), key=lambda x: x[0])
+        
+        hyperparams_nn['model_type'] = model_type
+        hyperparams_nn['map5'] = float(map5)
+        
+        return hyperparams_nn
+    
+    
     def train_best(self, hyperparams):
         
         """
@@ -133,7 +277,7 @@ class TrainImplicit:
         Parameters
         ----------
         hyperparams: dict
-            Hyperparameters from best model fit
+            Hyperparameters from best model fit, optionally with model_type
 
         Returns
         -------            
@@ -141,6 +285,13 @@ class TrainImplicit:
         """
 
         
+        # Item-item models - no confidence scaling needed
+        model_type = hyperparams.get("model_type", "als")
+        if model_type in NEAREST_NEIGHBOURS:
+            model_nn = NEAREST_NEIGHBOURS[model_type](**{k: hyperparams[k] for k in ("K", "K1", "B") if k in hyperparams})
+            model_nn.fit(self.sparse_item_user)
+            return model_nn
+        
         # Initialize a model with best hyperparameters        
         model_implicit = implicit.als.AlternatingLeastSquares(factors=hyperparams["factors"],
                                                               regularization=hyperparams["regularization"],
@@ -148,11 +299,15 @@ class TrainImplicit:
                                                               )
         
         alpha=hyperparams["alpha"]
-        data = (self.sparse_item_user * alpha).astype('double')
+        ratings = self.sparse_item_user.data.copy()
 
         
-        # train the model on a sparse matrix of item/user/confidence weights
-        model_implicit.fit(data)
+        # train the model on a sparse matrix of item/user/confidence weights - scaled
+        # in place and restored afterwards, as the ratings are used again downstream
+        try:
+            model_implicit.fit(self._scale_confidence(self.sparse_item_user, ratings, alpha))
+        finally:
+            self.sparse_item_user.data[:] = ratings
 
         
         return model_implicit
\ No newline at end of file
@@ -4,10 +4,11 @@ predictions.py
 Batch predictions for implicit model
 """
 
+import os
+import json
+import numpy as np
 import pandas as pd
 import implicit
-from collections import defaultdict
-from itertools import islice
 from scipy.sparse import coo_matrix, csr_matrix
 
 
@@ -25,7 +26,7 @@ class BatchPredictions:
         
         print("Batch Predictions Object Created")
 
-    def _similar_products_implicit(self, item_id, model_implicit, df_products, N = 11):
+    def _similar_products_implicit(self, item_id, model_implicit, products, candidates, N = 11):
         """
         Predict N similar products
     
@@ -36,6 +37,10 @@ class BatchPredictions:
             product integer id
         model_implicit: implicit model
             model
+        products: dictionary
+            sku & name for each product integer id
+        candidates: numpy array
+            True for products which may be recommended
         N: int
             Number of similar products
     
@@ -43,60 +48,124 @@ class BatchPredictions:
         Returns
         -------
     
-        sim: Dataframe
-            dataframe with similar products
+        rel: list
+            sku & name of up to N - 1 similar products, the product itself excluded
     
         """
                     
-        # Similar products
-        rel = model_implicit.similar_items(item_id,N)
+        # Similar products - the product itself is not necessarily ranked first,
+        # e.g. BM25 scores are unnormalised and K pruning can drop it from its own row.
+        # Products without interactions only have their random initial ALS factors,
+        # so fetch more until enough candidates are left after filtering them out
+        n = min(2 * N, len(candidates))
+        while True:
+            similar = model_implicit.similar_items(item_id,n)
+            rel = [product_int_id for product_int_id, _ in similar
+                   if product_int_id != item_id and candidates[product_int_id]]
+            
+            if len(rel) >= N - 1 or len(similar) < n or n >= len(candidates):
+                break
+            n = min(2 * n, len(candidates))
         
-        # Find related products and infos in df_products
+        rel = rel[:N - 1]
         
-        first, snd = zip(*rel)
-        # Transform to Dataframe
-        rel = pd.DataFrame(first, columns = ['product_int_id'])
-
-        # Merge columns, we need for interactions with API when similar products requested
-        rel = rel.merge(df_products[['product_int_id','sku','name']], how='left', on='product_int_id')
+        # Look up infos, we need for interactions with API when similar products requested
+        empty = {'sku': None, 'name': None}
         
-        return rel
+        return [products.get(product_int_id, empty) for product_int_id in rel]
     
         
-    def product_batch_predictions_implicit(self):
+    def product_batch_predictions_implicit(self, N = 11):
         """
         Loop through products & predict similar products according to implicit model
 
+        Parameters
+        ----------
+        N: int
+            Number of similar products, the product itself included
 
-        Returns
+
+        Yields
         -------
-        d_impl: dictionary
-            dictionary of all similar products
+        (sku, dd_impl): tuple
+            sku of a product & dictionary of its similar products
     
         """
     
-        # Initiate dictionary
-        d_impl = defaultdict(dict)
+        # sku & name by product integer id
+        products = self.df_products.set_index('product_int_id')[['sku','name']].to_dict('index')
+        
+        # Products without interactions (e.g. pruned) or neighbors fall back to the most popular products
+        interactions = np.diff(self.sparse_item_user.tocsr().indptr)
+        candidates = interactions > 0
+        popular = [p for p in np.argsort(-interactions, kind='stable')[:N] if candidates[p]]
         
         iters = self.sparse_item_user.shape[0] # length of rows 
         for x in range(iters):
             
-            print(x)
+            if x % 1000 == 0:
+                print(f"  --- Batch Predictions - Product {x} of {iters}")
+            
+            pred_related_implicit = []
+            if interactions[x] > 0:
+                pred_related_implicit = self._similar_products_implicit(x,
+                                                                        self.model_implicit,
+                                                                        products, candidates, N)
             
-            pred_related_implicit = self._similar_products_implicit(x,
-                                                                    self.model_implicit,
-                                                                    self.df_products)
+            empty = {'sku': None, 'name': None}
+            
+            # Item-item models return no neighbors for products without similarities
+            if not pred_related_implicit:
+                pred_related_implicit = [products.get(p, empty) for p in popular if p != x][:N - 1]
                 
-            sku = pred_related_implicit.iloc[0]['sku']
+            sku = products.get(x, empty)['sku']
             
             # Create dictionary for similar products
-            dd_impl = defaultdict(dict)
+            dd_impl = {str(i): row for i, row in enumerate(pred_related_implicit, start=1)}
             
-            for i, row in islice(pred_related_implicit.iterrows(), 1, None):
-                dd_impl[i] = row.drop(['product_int_id']).to_dict()
-                
-            # Store similar products in dictionary
-            d_impl[sku] = dd_impl
+            yield sku, dd_impl
+    
+    
+    def write_batch_predictions(self, path):
+        """
+        Stream similar products of all products into a JSON file
+        
+        Entries are written one line per product while predicting, so memory stays
+        constant regardless of the catalog size and the file is loaded by the API as is.
+        The file at path is only replaced once all products are written.
+
+        Parameters
+        ----------
+        path: String
+            Path of related_items.json
 
+        Returns
+        -------
+        n: int
+            Number of products written
+    
+        """
+        
+        n = 0
+        
+        # Stream into a temporary file & swap it in once complete, as the API
+        # may (re)load the live file at any time during the prediction loop
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as outfile:
+                outfile.write("{")
+                
+                for sku, dd_impl in self.product_batch_predictions_implicit():
+                    outfile.write(",\n" if n else "\n")
+                    outfile.write(json.dumps(sku) + ": " + json.dumps(dd_impl))
+                    n += 1
+                    
+                outfile.write("\n}\n")
+            
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
         
-        return d_impl  
\ No newline at end of file
+        return n
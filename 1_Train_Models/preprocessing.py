@@ -113,6 +113,9 @@ class PreProcess:
 
         # Transform from long to wide
         data = data.pivot_table(index =['clientId','sku'], columns='eventType', values='count')
+        
+        # Small batches may not contain every eventType
+        data = data.reindex(columns=['pageview','purchase','addToCart','removedFromCart'])
         data = data.fillna(0)
         
         # Rating of User Interactions
@@ -144,6 +147,19 @@ class PreProcess:
 
         return data
     
+    def create_ratings(self):
+        """
+        Rates every client/product pair of the raw data, without assigning integer ids
+        - also used by foldin.py for micro-batches of new events
+        
+        Returns
+        -------
+        ratings: Dataframe
+            clientId, sku, event counts & rating for each client/product pair
+        """
+        
+        return self._merge_transform_raw_data(self.raw_data, self.catalog).reset_index()
+    
     
     def create_catalog(self, id_column = 'product_int_id'):
         """
@@ -199,8 +215,11 @@ class PreProcess:
         products = self.create_catalog()
         clients = self.create_clients()
         
+        # Number of all clients, incl. those without actions - used for the matrix shape
+        self.n_clients = len(clients)
+        
         # Merge & transform raw Data
-        user_actions = self._merge_transform_raw_data(self.raw_data, products).reset_index()
+        user_actions = self.create_ratings()
                 
         # Merge transformed user_actions with product catalog
         user_actions_merged = pd.merge(user_actions, products, on = 'sku')
@@ -211,20 +230,105 @@ class PreProcess:
         return user_actions_full_merge
     
     
-    def transform(self):
+    def _prune(self, df_actions, min_user_interactions = 1, min_item_interactions = 1, max_user_interactions = None):
+        """
+        Cap interactions per client and iteratively remove clients & products below
+        interaction thresholds (k-core)
+        
+        Parameters
+        -----------
+        df_actions: Dataframe
+            All actions with unique integer ids of clients and products
+        min_user_interactions: int
+            Minimum number of products a client interacted with
+        min_item_interactions: int
+            Minimum number of clients who interacted with a product
+        max_user_interactions: int, optional
+            Maximum number of products per client, highest ratings are kept
+            
+        Returns
+        -------
+        df_actions: Dataframe
+            Pruned actions
+        """
+        
+        stats = {
+            "users_before": df_actions['client_int_id'].nunique(),
+            "items_before": df_actions['product_int_id'].nunique(),
+            "interactions_before": len(df_actions),
+        }
+        
+        # Cap extreme clients to their highest rated products
+        if max_user_interactions:
+            df_actions = df_actions.sort_values('rating', ascending=False, kind='mergesort')
+            df_actions = df_actions[df_actions.groupby('client_int_id').cumcount() < max_user_interactions]
+        
+        # Removing clients can push products below their threshold and vice versa
+        iterations = 0
+        while True:
+            user_counts = df_actions.groupby('client_int_id')['product_int_id'].transform('size')
+            item_counts = df_actions.groupby('product_int_id')['client_int_id'].transform('size')
+            keep = (user_counts >= min_user_interactions) & (item_counts >= min_item_interactions)
+            
+            if keep.all():
+                break
+            
+            df_actions = df_actions[keep]
+            iterations += 1
+        
+        stats.update({
+            "users_after": df_actions['client_int_id'].nunique(),
+            "items_after": df_actions['product_int_id'].nunique(),
+            "interactions_after": len(df_actions),
+            "pruning_iterations": iterations,
+        })
+        
+        self.pruning_stats = stats
+        print(f"Pruning: {stats}")
+        
+        return df_actions
+    
+    
+    def transform(self, min_user_interactions = 1, min_item_interactions = 1, max_user_interactions = None):
         """
         Creates a sparse csr matrix of user-item interactions
         
+        Pruned clients and products keep their integer ids with empty columns / rows,
+        so they are still covered by fallbacks in batch predictions and by foldin.py
+        
+        Parameters
+        -----------
+        min_user_interactions, min_item_interactions, max_user_interactions: int
+            Pruning thresholds, see _prune
         
         Returns
         -------
-        sparse_item_user: Dataframe
-            A dataframe of clients with unique integer ids
+        sparse_item_user: sparse csr_matrix [n_items, n_users]
+            Interaction matrix of products & clients
+            
+            The unpruned matrix is kept as sparse_item_user_unpruned, to evaluate
+            every pruning setting on the same holdout - delete it once the holdout is split
         """
         
         df_actions = self.create_actions()
         
-        sparse_item_user = sparse.csr_matrix((df_actions['rating'].astype(float), (df_actions['product_int_id'], df_actions['client_int_id'])))
+        shape = (len(self.catalog), self.n_clients)
+        
+        def to_sparse(df):
+            # float32 ratings & int32 indices halve the memory of the default float64/int64
+            return sparse.csr_matrix((df['rating'].to_numpy(np.float32),
+                                      (df['product_int_id'].to_numpy(np.int32), df['client_int_id'].to_numpy(np.int32))),
+                                     shape=shape, dtype=np.float32)
+        
+        df_pruned = self._prune(df_actions, min_user_interactions, min_item_interactions, max_user_interactions)
+        
+        sparse_item_user = to_sparse(df_pruned)
+        
+        # Share the matrix if pruning removed nothing
+        if len(df_pruned) == len(df_actions):
+            self.sparse_item_user_unpruned = sparse_item_user
+        else:
+            self.sparse_item_user_unpruned = to_sparse(df_actions)
         
         return sparse_item_user
 
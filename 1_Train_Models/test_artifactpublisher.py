@@ -0,0 +1,95 @@
+"""
+test_artifactpublisher.py
+~~~~~~
+Check publish, flush & verify of ArtifactPublisher against a file store and an S3 stand-in
+
+    $ python -m pytest 1_Train_Models/test_artifactpublisher.py
+"""
+
+import os
+
+import pytest
+
+from artifactpublisher import ArtifactPublisher
+
+
+class LocalS3:
+    """
+    In-memory stand-in for the two S3 client calls ArtifactPublisher uses
+    """
+
+    def __init__(self, corrupt=()):
+        self.objects = {}
+        self.corrupt = corrupt
+
+    def upload_file(self, local_path, bucket, key, Config=None):
+        with open(local_path, 'rb') as file:
+            body = file.read()
+        if key in self.corrupt:
+            body = body[:-1]
+        self.objects[(bucket, key)] = body
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+
+def _write(path, content):
+    with open(path, 'w') as outfile:
+        outfile.write(content)
+    return str(path)
+
+
+def test_file_store(tmp_path):
+    local = _write(tmp_path / "related_items.json", '{"a": {}}')
+    root = tmp_path / "artifacts"
+
+    with ArtifactPublisher(f"file://{root}") as publisher:
+        publisher.publish(local, "data")
+        destinations = publisher.flush()
+
+    assert destinations == [os.path.join(str(root), "data", "related_items.json")]
+    with open(destinations[0]) as file:
+        assert file.read() == '{"a": {}}'
+
+
+def test_s3_stand_in(tmp_path):
+    pytest.importorskip("boto3")
+
+    s3 = LocalS3()
+    products = _write(tmp_path / "df_products.csv", "sku,name\n1,a\n")
+    related = _write(tmp_path / "related_items.json", "{}")
+
+    publisher = ArtifactPublisher("s3://mlflow/1/run/artifacts", s3_client=s3)
+    publisher.publish(products, "data")
+    publisher.publish(related, "data")
+    task = publisher.submit(lambda: "model logged")
+
+    assert publisher.close() == ["1/run/artifacts/data/df_products.csv",
+                                 "1/run/artifacts/data/related_items.json",
+                                 "<lambda>"]
+    assert task.result() == "model logged"
+    assert set(s3.objects) == {("mlflow", "1/run/artifacts/data/df_products.csv"),
+                               ("mlflow", "1/run/artifacts/data/related_items.json")}
+
+
+def test_flush_reports_every_failure(tmp_path):
+    pytest.importorskip("boto3")
+
+    s3 = LocalS3(corrupt={"artifacts/a.csv"})
+    publisher = ArtifactPublisher("s3://mlflow/artifacts", s3_client=s3)
+
+    publisher.publish(_write(tmp_path / "a.csv", "abc"))
+    publisher.publish(_write(tmp_path / "b.csv", "abc"))
+    publisher.submit(lambda: 1 / 0)
+
+    with pytest.raises(RuntimeError) as error:
+        publisher.close()
+
+    message = str(error.value)
+    assert "2 artifacts failed" in message
+    assert "artifacts/a.csv" in message
+    assert "artifacts/b.csv" not in message
+    assert "ZeroDivisionError" in message
+
+    # Failed artifacts are reported once, not again on the next flush
+    assert publisher.flush() == []
@@ -0,0 +1,111 @@
+"""
+test_foldin.py
+~~~~~~
+Check IncrementalUpdate against a dense ALS solution and the merge of publish_delta
+
+    $ python -m pytest 1_Train_Models/test_foldin.py
+"""
+
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from foldin import IncrementalUpdate, publish_delta
+
+
+ALPHA = 10.0
+REGULARIZATION = 0.1
+
+
+def _update():
+    """
+    Fold-in state of 4 products & 2 clients with random factors
+    """
+
+    rng = np.random.RandomState(0)
+
+    df_products = pd.DataFrame({'sku': ['s0', 's1', 's2', 's3'],
+                                'product_url': ['u0', 'u1', 'u2', 'u3'],
+                                'name': ['a', 'b', 'c', 'd'],
+                                'product_int_id': np.arange(4)})
+    df_clients = pd.DataFrame({'clientId': ['c0', 'c1'], 'client_int_id': np.arange(2)})
+
+    sparse_item_user = sparse.csr_matrix(np.array([[1, 0],
+                                                   [5, 2],
+                                                   [0, 1],
+                                                   [1, 1]], dtype=np.float32))
+
+    # Only the attributes fold-in uses of implicit's AlternatingLeastSquares
+    model = SimpleNamespace(item_factors=rng.rand(4, 3).astype(np.float32),
+                            user_factors=rng.rand(2, 3).astype(np.float32),
+                            regularization=REGULARIZATION)
+
+    return IncrementalUpdate(sparse_item_user, df_products, df_clients, model, ALPHA, N=3)
+
+
+def _events(rows):
+    return pd.DataFrame(rows, columns=['clientId', 'eventType', 'eventData', 'dateHourMinute'])
+
+
+def test_new_client_matches_dense_solution():
+    update = _update()
+    item_factors = update.model_implicit.item_factors.copy()
+
+    # One pageview of s0 (rating 1) & a purchase of s2 (rating 5)
+    update.update(_events([['new', 'pageview', 'u0', 1],
+                           ['new', 'purchase', 's2', 2]]))
+
+    assert update.df_clients['clientId'].tolist() == ['c0', 'c1', 'new']
+    assert update.df_clients['client_int_id'].tolist() == [0, 1, 2]
+    assert update.sparse_item_user.shape == (4, 3)
+    assert update.model_implicit.user_factors.shape == (3, 3)
+
+    # Dense ALS: confidence 1 for unseen products, preference 1 for seen ones
+    confidence = np.ones(4)
+    confidence[[0, 2]] = ALPHA * np.array([1, 5])
+    preference = np.array([1, 0, 1, 0])
+
+    Y = item_factors.astype(np.float64)
+    A = Y.T.dot(confidence[:, None] * Y) + REGULARIZATION * np.eye(3)
+    b = Y.T.dot(confidence * preference)
+
+    np.testing.assert_allclose(update.model_implicit.user_factors[2], np.linalg.solve(A, b), rtol=1e-4)
+
+
+def test_items_outside_batch_keep_factors():
+    update = _update()
+    item_factors = update.model_implicit.item_factors.copy()
+    user_factors = update.model_implicit.user_factors.copy()
+
+    delta = update.update(_events([['c0', 'addToCart', 's2', 1]]))
+
+    np.testing.assert_array_equal(update.model_implicit.item_factors[[0, 1, 3]], item_factors[[0, 1, 3]])
+    np.testing.assert_array_equal(update.model_implicit.user_factors[1], user_factors[1])
+    assert not np.array_equal(update.model_implicit.item_factors[2], item_factors[2])
+
+    # Only the touched product is refreshed, never recommending itself
+    assert list(delta) == ['s2']
+    assert len(delta['s2']) == 2
+    assert all(row['sku'] != 's2' for row in delta['s2'].values())
+
+
+def test_publish_delta_merges(tmp_path):
+    path = str(tmp_path / "related_items_delta.json")
+    with open(path, 'w') as outfile:
+        json.dump({"s0": {"1": {"sku": "s1", "name": "b"}},
+                   "s1": {"1": {"sku": "s0", "name": "a"}}}, outfile)
+
+    publish_delta({"s1": {"1": {"sku": "s2", "name": "c"}},
+                   "s2": {"1": {"sku": "s1", "name": "b"}}}, path)
+
+    with open(path, 'r') as file:
+        merged = json.load(file)
+
+    assert merged == {"s0": {"1": {"sku": "s1", "name": "b"}},
+                      "s1": {"1": {"sku": "s2", "name": "c"}},
+                      "s2": {"1": {"sku": "s1", "name": "b"}}}
+    assert os.listdir(str(tmp_path)) == ["related_items_delta.json"]
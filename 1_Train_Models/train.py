@@ -6,17 +6,19 @@ Major steps:
     #1 Load Data
     #2 Preprocess Data
     #3 Training
-    #4 MLflow logging metrics & parameters
-    #5 Batch Predicitions
-    #6 MLflow saving and logging of model
+    #4 MLflow saving and logging of model (in the background)
+    #5 MLflow logging metrics & parameters
+    #6 Batch Predicitions
 """
 
 import os
+import time
 # import sqlalchemy - needed if data is fetched from Database
 import pandas as pd
 import implicit
 import joblib
 import json
+import scipy.sparse as sparse
 from datetime import date
 import mlflow
 import logging
@@ -44,6 +46,21 @@ print('\n')
 MIN_SAMPLE_OUTPUT = 35
 GIT_PYTHON_REFRESH= "quiet"
 
+# Pruning of clients & products before training (k-core) - defaults keep all interactions, 0 disables the cap
+PRUNING = dict(
+    min_user_interactions=int(os.environ.get("PRUNE_MIN_USER_INTERACTIONS", 1)),
+    min_item_interactions=int(os.environ.get("PRUNE_MIN_ITEM_INTERACTIONS", 1)),
+    max_user_interactions=int(os.environ.get("PRUNE_MAX_USER_INTERACTIONS", 0)),
+)
+
+# Model type - "als" or an item-item model "cosine", "bm25", "tfidf" as fast alternative
+from modeltraining import NEAREST_NEIGHBOURS
+
+MODEL_TYPE = os.environ.get("MODEL_TYPE", "als").strip().lower()
+if MODEL_TYPE not in {"als"} | NEAREST_NEIGHBOURS.keys():
+    raise ValueError(f"Unknown MODEL_TYPE {MODEL_TYPE!r}, expected one of: "
+                     + ", ".join(["als", *NEAREST_NEIGHBOURS]))
+
 # MLflow settings
 mlflow_settings = dict(
     username="mlflow",
@@ -80,136 +97,174 @@ conda_env = {
 }
 
 
+def log_implicit_model(model_name, implicit_model_path):
+    """
+    Log the stored implicit model as MLflow pyfunc model to the active run & register it
+    
+    Parameters
+    ----------
+    model_name: String
+        Name of the registered model
+    implicit_model_path: String
+        Path of the joblib file
+    """
+    
+    tracking_url_type_store = urlparse(mlflow.get_tracking_uri()).scheme
+    print(tracking_url_type_store)
+    
+    from implicitwrapper import ImplicitWrapper
+    
+    # Create an 'artifacts' dictionary that assigns a unique name to the saved implicit model file.
+    # This dictionary will be passed to 'mlflow.pyfunc.save_model', which will copy the model file
+    # into the new MLflow Model's directory.
+
+    artifacts = {
+        "implicit_model": implicit_model_path
+        }
+    
+    mlflow_pyfunc_model_path = model_name
+    
+    # Model registry does not work with file store
+    if tracking_url_type_store != "file":
+        mlflow.pyfunc.log_model("model",
+                                 registered_model_name=model_name,
+                                 python_model=ImplicitWrapper(),
+                                 artifacts=artifacts)
+    else:
+        mlflow.pyfunc.log_model("model",
+                                 path=mlflow_pyfunc_model_path,
+                                 python_model=ImplicitWrapper(),
+                                 artifacts=artifacts)
+
+
 def train():
     
     with mlflow.start_run(run_name=f"recommender_{current_date}"):
         
+        # Import Class ArtifactPublisher
+        from artifactpublisher import ArtifactPublisher
+        
+        # Upload artifacts in background threads while the pipeline continues - flushed & verified on exit
+        with ArtifactPublisher(mlflow.get_artifact_uri()) as publisher:
             
-        #############################################################################
-        # ----------------------------------- # 1 --------------------------------- #
-        # ------------- Load Product Catalog & Raw User Journey Data -------------- #
-        #############################################################################
+            #############################################################################
+            # ----------------------------------- # 1 --------------------------------- #
+            # ------------- Load Product Catalog & Raw User Journey Data -------------- #
+            #############################################################################
         
-        product_catalog = pd.read_csv("./0_Data/product_catalog.csv")
-        raw_data =  pd.read_csv("./0_Data/journey.csv")        
+            product_catalog = pd.read_csv("./0_Data/product_catalog.csv")
+            raw_data =  pd.read_csv("./0_Data/journey.csv")        
     
-        #############################################################################
-        # ---------------------------------- # 2 ---------------------------------- #
-        # ---------------------------  Data preprocessing ------------------------- #
-        #############################################################################
+            #############################################################################
+            # ---------------------------------- # 2 ---------------------------------- #
+            # ---------------------------  Data preprocessing ------------------------- #
+            #############################################################################
     
-        # Import Class PreProcess
-        from preprocessing import PreProcess
+            # Import Class PreProcess
+            from preprocessing import PreProcess
         
-        # Instantiate Object
-        pre = PreProcess(product_catalog,raw_data)
+            # Instantiate Object
+            pre = PreProcess(product_catalog,raw_data)
         
-        # Create product dataframe
-        df_products = pre.create_catalog()
+            # Create product dataframe
+            df_products = pre.create_catalog()
         
-        # Create clients dataframe
-        # df_clients = pre.create_clients()
+            # Create clients dataframe
+            df_clients = pre.create_clients()
   
-        # Create sparse item user matrix
-        sparse_item_user = pre.transform()
+            # Create sparse item user matrix
+            sparse_item_user = pre.transform(**PRUNING)
         
+            # Log pruning thresholds & statistics - with search_seconds, fit_seconds & MAPat5 on the
+            # unpruned holdout they show the trade-off between training time and quality
+            mlflow.log_params(PRUNING)
+            mlflow.log_metrics({k: float(v) for k, v in pre.pruning_stats.items()})
         
-        # Log df_products as MLflow artifact
-        df_products.to_csv("0_Data/df_products.csv")
-        mlflow.log_artifact("0_Data/df_products.csv","data/")
         
-                
-        #############################################################################
-        # ---------------------------------- # 3 ---------------------------------- #
-        # ----------------- Find best hyper-parameters & train model -------------- #
-        #############################################################################
+            # Log df_products as MLflow artifact
+            df_products.to_csv("0_Data/df_products.csv")
+            publisher.publish("0_Data/df_products.csv", "data")
         
-        # Import Class TrainImplicit
-        from modeltraining import TrainImplicit
-        
-        # Instantiate Object
-        training = TrainImplicit(sparse_item_user)
+                
+            #############################################################################
+            # ---------------------------------- # 3 ---------------------------------- #
+            # ----------------- Find best hyper-parameters & train model -------------- #
+            #############################################################################
         
-        # Find best model and get hyperparameters
-        best_hyperparams = training.random_search_implicit(num_samples=15)
+            # Import Class TrainImplicit
+            from modeltraining import TrainImplicit
         
-        # Fit model with best hyperparameters
-        best_model = training.train_best(best_hyperparams)
+            # Instantiate Object
+            training = TrainImplicit(sparse_item_user, pre.sparse_item_user_unpruned)
         
-        #############################################################################
-        # --------------------------------- # 4 ----------------------------------- #
-        # ------------------- MLflow - Logging Metrics &Paramters------------------ #
-        #############################################################################
+            # Find best model and get hyperparameters
+            start = time.perf_counter()
+            if MODEL_TYPE == "als":
+                best_hyperparams = training.random_search_implicit(num_samples=15)
+            else:
+                best_hyperparams = training.search_nearest_neighbours(num_samples=15, model_type=MODEL_TYPE)
+            mlflow.log_metric("search_seconds", time.perf_counter() - start)
         
-        # Log Hyperparameters & MAP@5
-        mlflow.log_metric("MAPat5", best_hyperparams["map5"])
-        mlflow.log_param("alpha", best_hyperparams["alpha"])
-        mlflow.log_param("factors", best_hyperparams["factors"])
-        mlflow.log_param("regularization", best_hyperparams["regularization"])
-        mlflow.log_param("iterations", best_hyperparams["iterations"])
-        mlflow.log_param("Date", current_date)
+            # Unpruned matrix was only needed for the holdout
+            del pre.sparse_item_user_unpruned
         
-        #############################################################################
-        # ---------------------------------- # 5 ---------------------------------- #
-        # ----------------- Batch Predictions for related products  --------------- #
-        #############################################################################
+            # Fit model with best hyperparameters
+            start = time.perf_counter()
+            best_model = training.train_best(best_hyperparams)
+            mlflow.log_metric("fit_seconds", time.perf_counter() - start)
         
-        from predictions import BatchPredictions
+            # Keep state for intra-day fold-in of new events (foldin.py)
+            sparse.save_npz("0_Data/sparse_item_user.npz", sparse_item_user)
+            df_clients.to_csv("0_Data/df_clients.csv")
+            with open("0_Data/best_hyperparams.json", 'w') as outfile:
+                json.dump(best_hyperparams, outfile, default=float)
         
-        # Instantiate Object
-        pred = BatchPredictions(sparse_item_user,df_products,best_model)
+            #############################################################################
+            # ---------------------------------- # 4 ---------------------------------- #
+            # ---------------------------- MLflow save & log model -------------------- #
+            #############################################################################
         
-        # Batch Predictions
-        related_items = pred.product_batch_predictions_implicit()
+            # Model name & path 
+            model_name = "implicit_model"
+            implicit_model_path = model_name + ".joblib"
+                    
+            # Store implicit model as joblib file
+            joblib.dump(best_model, implicit_model_path, compress=True)
+            print('Implicit Model saved')
         
-        # Store related_items.json in 0_Data
-        with open("0_Data/related_items.json", 'w') as outfile:
-            json.dump(related_items, outfile, indent = 4, sort_keys = False)
-            print("related_implicit.json stored in 0_Data")
-        # Log related_items.json as artifact
-        mlflow.log_dict(related_items, "data/related_items.json")
+            # Package, upload & register the pyfunc model in the background while batch predictions run
+            publisher.submit(log_implicit_model, model_name, implicit_model_path)
         
+            #############################################################################
+            # --------------------------------- # 5 ----------------------------------- #
+            # ------------------- MLflow - Logging Metrics &Paramters------------------ #
+            #############################################################################
         
-        #############################################################################
-        # ---------------------------------- # 6 ---------------------------------- #
-        # ---------------------------- MLflow save & log model -------------------- #
-        #############################################################################
+            # Log Hyperparameters & MAP@5
+            mlflow.log_metric("MAPat5", best_hyperparams["map5"])
+            for param in ("model_type", "alpha", "factors", "regularization", "iterations", "K", "K1", "B"):
+                if param in best_hyperparams:
+                    mlflow.log_param(param, best_hyperparams[param])
+            mlflow.log_param("Date", current_date)
         
+            #############################################################################
+            # ---------------------------------- # 6 ---------------------------------- #
+            # ----------------- Batch Predictions for related products  --------------- #
+            #############################################################################
         
-        tracking_url_type_store = urlparse(mlflow.get_tracking_uri()).scheme
-        print(tracking_url_type_store)
+            from predictions import BatchPredictions
         
-        from implicitwrapper import ImplicitWrapper
+            # Instantiate Object
+            pred = BatchPredictions(sparse_item_user,df_products,best_model)
         
-        # Model name & path 
-        model_name = "implicit_model"
-        implicit_model_path = model_name + ".joblib"
-                    
-        # Store implicit model as joblib file
-        joblib.dump(best_model, implicit_model_path, compress=True)
-        print('Implicit Model saved')
-
-        # Create an 'artifacts' dictionary that assigns a unique name to the saved implicit model file.
-        # This dictionary will be passed to 'mlflow.pyfunc.save_model', which will copy the model file
-        # into the new MLflow Model's directory.
-
-        artifacts = {
-            "implicit_model": implicit_model_path
-            }
-        
-        mlflow_pyfunc_model_path = model_name
-        
-        # Model registry does not work with file store
-        if tracking_url_type_store != "file":
-            mlflow.pyfunc.log_model("model",
-                                     registered_model_name="implicit_model",
-                                     python_model=ImplicitWrapper(),
-                                     artifacts=artifacts)
-        else:
-            mlflow.pyfunc.log_model("model",
-                                     path=mlflow_pyfunc_model_path,
-                                     python_model=ImplicitWrapper(),
-                                     artifacts=artifacts)
+            # Batch Predictions - streamed to related_items.json in 0_Data
+            n_related = pred.write_batch_predictions("0_Data/related_items.json")
+            print(f"related_items.json with {n_related} products stored in 0_Data")
+            # Deltas of the previous day are contained in the new related items
+            if os.path.exists("0_Data/related_items_delta.json"):
+                os.remove("0_Data/related_items_delta.json")
+            # Log related_items.json as artifact
+            publisher.publish("0_Data/related_items.json", "data")
 
 if __name__ == '__main__':
     train()
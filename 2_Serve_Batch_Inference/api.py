@@ -7,6 +7,7 @@ Defines a simple REST API with Flask for Batch-Inference
 from flask import Flask, request # abort, jsonify, make_response
 # from pandas import DataFrame
 import os
+import time
 import warnings
 import json
 # Ignore warnings
@@ -24,11 +25,39 @@ with open("./0_Data/related_items.json", 'r') as file:
     implicit_related = json.load(file)
     print("related_items.json loaded")
 
+# Intra-day updates of related items published by foldin.py
+DELTA_PATH = "./0_Data/related_items_delta.json"
+DELTA_CHECK_SECONDS = 10
+delta_state = {"checked": 0, "mtime": None}
+
+
+def apply_delta():
+    """Merge the latest related items delta, checking the file at most every DELTA_CHECK_SECONDS"""
+    
+    now = time.time()
+    if now - delta_state["checked"] < DELTA_CHECK_SECONDS:
+        return
+    delta_state["checked"] = now
+    
+    try:
+        mtime = os.path.getmtime(DELTA_PATH)
+    except OSError:
+        return
+    
+    if mtime != delta_state["mtime"]:
+        with open(DELTA_PATH, 'r') as file:
+            implicit_related.update(json.load(file))
+        delta_state["mtime"] = mtime
+        print("related_items_delta.json applied")
+
+
 @app.route('/related_others_liked', methods=['GET','POST'])
 def related_others_liked():
     """Other users liked aswell - related products from implicit"""
     try:
         
+        apply_delta()
+        
         # Receive data
         data = request.get_json(force=True)
         print("Request received")
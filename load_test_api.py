@@ -0,0 +1,259 @@
+"""
+load_test_api.py
+~~~~~~
+Load test the related items API with a realistic sku distribution
+
+Example:
+    $ python3 load_test_api.py --start --workers 2 --concurrency 16 --rate 200 --duration 30
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+
+try:
+    import psutil
+except ImportError:  # per-worker memory is reported only if psutil is installed
+    psutil = None
+
+
+def load_sku_distribution(path):
+    """
+    Build sku sampling weights from the related items artifact
+
+    Skus which appear more often as neighbors of other products are requested more often,
+    which approximates the popularity skew of real traffic.
+
+    Parameters
+    ----------
+    path: String
+        Path to related_items.json
+
+    Returns
+    -------
+    skus: list
+        All skus served by the API
+    weights: list
+        Sampling weight for each sku
+    """
+
+    with open(path, 'r') as file:
+        related = json.load(file)
+
+    counts = Counter(row['sku'] for neighbors in related.values() for row in neighbors.values())
+
+    skus = list(related)
+    weights = [counts[sku] + 1 for sku in skus]
+
+    return skus, weights
+
+
+def start_api(serve_dir, port, workers):
+    """
+    Start the API with gunicorn in the background and wait until it accepts requests
+    """
+
+    # Run from the project root, so the API finds ./0_Data/related_items.json
+    env = dict(os.environ, SERVICE_NAME="recommender", API_VERSION="1")
+    process = subprocess.Popen(["gunicorn", "--bind", f"0.0.0.0:{port}", f"--workers={workers}",
+                                "--pythonpath", serve_dir, "api:app"],
+                               env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # gunicorn binds the port before its workers have loaded related_items.json,
+    # so connection errors & read timeouts both mean "not ready yet"
+    try:
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                requests.get(f"http://0.0.0.0:{port}/", timeout=1)
+                return process
+            except requests.RequestException:
+                time.sleep(0.5)
+
+        raise RuntimeError("API did not start within 60 seconds")
+    except BaseException:
+        process.terminate()
+        process.wait()
+        raise
+
+
+def worker_memory(pid):
+    """
+    Resident memory in MB of the gunicorn master's worker processes,
+    None if it cannot be measured
+    """
+
+    if psutil is None or pid is None:
+        return None
+
+    master = psutil.Process(pid)
+
+    return {str(child.pid): round(child.memory_info().rss / 1024 ** 2, 1)
+            for child in master.children()}
+
+
+def run_load(url, skus, weights, concurrency, rate, duration, timeout):
+    """
+    Send requests from concurrent workers for a given duration
+
+    Parameters
+    ----------
+    url: String
+        Endpoint to test
+    skus, weights: list
+        Sku distribution to sample from
+    concurrency: int
+        Number of concurrent client threads
+    rate: float
+        Target requests per second over all threads, 0 for as fast as possible
+    duration: float
+        Test duration in seconds
+    timeout: float
+        Request timeout in seconds
+
+    Returns
+    -------
+    latencies: list
+        Latency in seconds of every successful request
+    errors: Counter
+        Failed requests by status code or exception name
+    elapsed: float
+        Wall clock duration of the test
+    """
+
+    latencies = []
+    errors = Counter()
+    lock = threading.Lock()
+
+    # Cumulative weights once, so sampling a sku is a binary search per request
+    cum_weights = list(itertools.accumulate(weights))
+
+    interval = concurrency / rate if rate else 0
+    start = time.perf_counter()
+    stop = start + duration
+
+    def client(seed):
+        session = requests.Session()
+        rng = random.Random(seed)
+        next_send = start + rng.random() * interval
+
+        while True:
+            if interval:
+                wait = next_send - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                next_send += interval
+            if time.perf_counter() >= stop:
+                break
+
+            sku = rng.choices(skus, cum_weights=cum_weights)[0]
+            sent = time.perf_counter()
+            try:
+                r = session.post(url, json={"sku": sku}, timeout=timeout)
+                latency = time.perf_counter() - sent
+                with lock:
+                    if r.status_code == 200:
+                        latencies.append(latency)
+                    else:
+                        errors[str(r.status_code)] += 1
+            except requests.RequestException as e:
+                with lock:
+                    errors[type(e).__name__] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return latencies, errors, time.perf_counter() - start
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Load test the related items API")
+    parser.add_argument("--url", default="http://0.0.0.0:5001/related_others_liked")
+    parser.add_argument("--artifact", default="./0_Data/related_items.json")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0, help="target requests/s, 0 = unthrottled")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--timeout", type=float, default=5)
+    parser.add_argument("--start", action="store_true", help="start the API locally with gunicorn")
+    parser.add_argument("--serve-dir", default="./2_Serve_Batch_Inference")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers when using --start")
+    parser.add_argument("--pid", type=int, help="gunicorn master pid for memory reporting")
+    parser.add_argument("--report", default="./0_Data/load_test_{timestamp}.json")
+    args = parser.parse_args()
+
+    skus, weights = load_sku_distribution(args.artifact)
+    print(f"{len(skus)} skus loaded")
+
+    process = None
+    pid = args.pid
+    if args.start:
+        port = urlparse(args.url).port or 80
+        process = start_api(args.serve_dir, port, args.workers)
+        pid = process.pid
+        print(f"API started with {args.workers} workers")
+
+    try:
+        memory_before = worker_memory(pid)
+        latencies, errors, elapsed = run_load(args.url, skus, weights, args.concurrency,
+                                              args.rate, args.duration, args.timeout)
+        memory_after = worker_memory(pid)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    total = len(latencies) + sum(errors.values())
+    latencies_ms = np.array(latencies) * 1000
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "report"},
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 2),
+        "error_rate": round(sum(errors.values()) / total, 4) if total else None,
+        "errors": dict(errors),
+        "latency_ms": {
+            "mean": round(float(latencies_ms.mean()), 2),
+            "p50": round(float(np.percentile(latencies_ms, 50)), 2),
+            "p95": round(float(np.percentile(latencies_ms, 95)), 2),
+            "p99": round(float(np.percentile(latencies_ms, 99)), 2),
+            "max": round(float(latencies_ms.max()), 2),
+        } if len(latencies) else None,
+        "worker_memory_mb": {"before": memory_before, "after": memory_after},
+    }
+
+    # Say explicitly why memory is missing rather than reporting empty numbers
+    if psutil is None:
+        report["worker_memory_mb"] = "not measured - psutil is not installed"
+    elif pid is None:
+        report["worker_memory_mb"] = "not measured - pass --start or --pid"
+
+    print(json.dumps(report, indent=4))
+
+    path = args.report.format(timestamp=datetime.now().strftime("%Y%m%d_%H%M%S"))
+    with open(path, 'w') as outfile:
+        json.dump(report, outfile, indent=4)
+        print(f"Report stored in {path}")
+
+    return 0 if total else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())